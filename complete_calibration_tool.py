@@ -2,9 +2,14 @@ import os
 os.environ['KMP_DUPLICATE_LIB_OK'] = 'TRUE'
 
 import cv2
-import json
+import time
 import numpy as np
 
+from yolox_inference.common import read_json, spot_corners, write_json
+
+# Spot colors by row of 10: green, orange, then magenta for additional spots
+ROW_COLORS = np.array([[0, 255, 0], [0, 165, 255], [255, 0, 255]], dtype=np.uint8)
+
 def complete_lot_calibration():
     """
     Enhanced calibration tool to map ALL parking spots in the lot
@@ -35,39 +40,81 @@ def complete_lot_calibration():
     spots = []
     current_polygon = []
     spot_counter = 1
+    dirty = True  # Redraw needed
+    
+    # Static geometry of completed spots, rebuilt only when spots change
+    spot_pts = np.zeros((0, 4, 2), dtype=np.int32)
+    spot_contours = []
+    spot_centers = np.zeros((0, 2), dtype=np.int32)
+    row_groups = []
+    
+    def update_spot_geometry():
+        nonlocal spot_pts, spot_contours, spot_centers, row_groups
+        spot_pts = spot_corners(spots)
+        spot_contours = [np.ascontiguousarray(p).reshape(-1, 1, 2) for p in spot_pts]
+        spot_centers = spot_pts.mean(axis=1).astype(np.int32)
+        
+        # Contours grouped by row color, so drawing is one call per color
+        row_idx = np.minimum(np.arange(len(spots)) // 10, len(ROW_COLORS) - 1)
+        row_groups = [
+            ([spot_contours[i] for i in np.flatnonzero(row_idx == row)], tuple(color.tolist()))
+            for row, color in enumerate(ROW_COLORS)
+        ]
     
     # Load existing spots if they exist
     try:
-        with open("data/spot_layout.json", 'r') as f:
-            existing_spots = json.load(f)
-            spots.extend(existing_spots)
-            spot_counter = len(spots) + 1
-            print(f"Loaded {len(existing_spots)} existing spots")
+        existing_spots = read_json("data/spot_layout.json")
+        spots.extend(existing_spots)
+        update_spot_geometry()
+        spot_counter = len(spots) + 1
+        print(f"Loaded {len(existing_spots)} existing spots")
+    except ValueError as e:
+        spots.clear()
+        print(f"Ignoring invalid spot layout ({e}), starting fresh calibration")
     except:
+        spots.clear()
         print("Starting fresh calibration")
     
+    panel_cache = None  # (state_key, text_alpha)
+    
+    def render_panel():
+        instructions = [
+            f"Calibrating spot: {spot_counter}",
+            f"Points clicked: {len(current_polygon)}/4",
+            f"Total spots: {len(spots)}",
+            "",
+            "Controls:",
+            "s = Save & Exit",
+            "u = Undo last spot", 
+            "r = Reset current",
+            "q = Quit without saving"
+        ]
+        
+        # Text coverage over the (10, 10)-(300, 250) region of the display
+        panel = np.zeros((241, 291), dtype=np.uint8)
+        
+        y_pos = 20
+        for instruction in instructions:
+            cv2.putText(panel, instruction, (10, y_pos), 
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, 255, 1)
+            y_pos += 25
+        
+        return panel[..., None].astype(np.float32) / 255
+    
     def draw_interface():
+        nonlocal panel_cache
         display = original_image.copy()
         
-        # Draw completed spots
-        for i, spot in enumerate(spots):
-            pts = np.array(spot["polygon"], dtype=np.int32)
-            
-            # Different colors for different rows/areas
-            if i < 10:
-                color = (0, 255, 0)  # Green for first row
-            elif i < 20:
-                color = (0, 165, 255)  # Orange for second row  
-            else:
-                color = (255, 0, 255)  # Magenta for additional spots
-                
-            cv2.polylines(display, [pts], True, color, 2)
-            cv2.fillPoly(display, [pts], (*color, 30))
-            
-            # Add spot label
-            center_x = int(np.mean([p[0] for p in spot["polygon"]]))
-            center_y = int(np.mean([p[1] for p in spot["polygon"]]))
-            cv2.putText(display, spot["id"], (center_x-15, center_y), 
+        # Draw completed spots, one call per row color
+        for group, color in row_groups:
+            if group:
+                cv2.polylines(display, group, True, color, 2)
+                cv2.fillPoly(display, group, (*color, 30))
+        
+        # Add spot labels, offset left of each center in one pass
+        label_origins = (spot_centers - (15, 0)).tolist()
+        for spot, origin in zip(spots, label_origins):
+            cv2.putText(display, spot["id"], tuple(origin), 
                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 2)
         
         # Draw current polygon in progress
@@ -89,47 +136,41 @@ def complete_lot_calibration():
                     preview_pts = np.array([p1, p2, p3, p4], dtype=np.int32)
                     cv2.polylines(display, [preview_pts], True, (255, 255, 0), 1)
         
-        # Instructions overlay
-        instructions = [
-            f"Calibrating spot: {spot_counter}",
-            f"Points clicked: {len(current_polygon)}/4",
-            f"Total spots: {len(spots)}",
-            "",
-            "Controls:",
-            "s = Save & Exit",
-            "u = Undo last spot", 
-            "r = Reset current",
-            "q = Quit without saving"
-        ]
-        
-        # Semi-transparent background for text
-        overlay = display.copy()
-        cv2.rectangle(overlay, (10, 10), (300, 250), (0, 0, 0), -1)
-        cv2.addWeighted(overlay, 0.7, display, 0.3, 0, display)
+        # Instructions panel, re-rendered only when its text changes
+        state_key = (spot_counter, len(current_polygon), len(spots))
+        if panel_cache is None or panel_cache[0] != state_key:
+            panel_cache = (state_key, render_panel())
+        text_alpha = panel_cache[1]
         
-        y_pos = 30
-        for instruction in instructions:
-            color = (255, 255, 255) if instruction != "" else (255, 255, 255)
-            cv2.putText(display, instruction, (20, y_pos), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
-            y_pos += 25
+        # Semi-transparent background for white text, over the panel region only
+        roi = display[10:251, 10:301]
+        h, w = roi.shape[:2]
+        background = roi * 0.3
+        text_alpha = text_alpha[:h, :w]
+        display[10:251, 10:301] = np.rint(background + (255 - background) * text_alpha).astype(np.uint8)
         
         return display
     
     def mouse_callback(event, x, y, flags, param):
-        nonlocal current_polygon, spot_counter
+        nonlocal current_polygon, spot_counter, dirty
         
         if event == cv2.EVENT_LBUTTONDOWN:
             current_polygon.append([x, y])
+            dirty = True
             print(f"Point {len(current_polygon)}: ({x}, {y})")
             
             if len(current_polygon) == 4:
                 # Complete the spot
                 spot_id = f"spot_{spot_counter}"
-                spots.append({
-                    "id": spot_id,
-                    "polygon": current_polygon.copy()
-                })
+                spot = {"id": spot_id, "polygon": current_polygon.copy()}
+                try:
+                    spot_corners([spot])
+                except ValueError as e:
+                    print(f"✗ {e}, click its corners again")
+                    current_polygon = []
+                    return
+                spots.append(spot)
+                update_spot_geometry()
                 print(f"✓ Added {spot_id}")
                 current_polygon = []
                 spot_counter += 1
@@ -139,25 +180,28 @@ def complete_lot_calibration():
     cv2.resizeWindow("Complete Lot Calibration", min(1200, width), min(800, height))
     cv2.setMouseCallback("Complete Lot Calibration", mouse_callback)
     
-    # Main loop
+    # Main loop - only redraw when something changed
     while True:
-        display = draw_interface()
-        cv2.imshow("Complete Lot Calibration", display)
+        if dirty:
+            display = draw_interface()
+            cv2.imshow("Complete Lot Calibration", display)
+            dirty = False
         
-        key = cv2.waitKey(1) & 0xFF
+        # Pump GUI events without blocking, then pace the loop ourselves
+        key = cv2.pollKey() & 0xFF
+        if key == 0xFF:
+            time.sleep(0.016)
         
         if key == ord('q'):
             print("Calibration cancelled")
             break
         elif key == ord('s'):
             if len(spots) > 0:
-                with open(output_json, 'w') as f:
-                    json.dump(spots, f, indent=2)
+                write_json(spots, output_json)
                 print(f"✓ Saved {len(spots)} spots to {output_json}")
                 
                 # Also update the main spot layout file
-                with open("data/spot_layout.json", 'w') as f:
-                    json.dump(spots, f, indent=2)
+                write_json(spots, "data/spot_layout.json")
                 print("✓ Updated data/spot_layout.json")
                 
                 break
@@ -165,11 +209,14 @@ def complete_lot_calibration():
                 print("No spots to save!")
         elif key == ord('r'):
             current_polygon = []
+            dirty = True
             print("Reset current polygon")
         elif key == ord('u'):
             if len(spots) > 0:
                 removed = spots.pop()
+                update_spot_geometry()
                 spot_counter -= 1
+                dirty = True
                 print(f"Removed {removed['id']}")
             else:
                 print("No spots to undo!")
@@ -183,14 +230,8 @@ def complete_lot_calibration():
         print("\nSpot distribution:")
         
         # Analyze spot positions to suggest grouping
-        y_positions = []
-        for spot in spots:
-            avg_y = np.mean([p[1] for p in spot["polygon"]])
-            y_positions.append(avg_y)
-        
-        if y_positions:
-            y_positions.sort()
-            print(f"Y-coordinate range: {int(min(y_positions))} to {int(max(y_positions))}")
+        y_positions = spot_pts[:, :, 1].mean(axis=1)
+        print(f"Y-coordinate range: {int(y_positions.min())} to {int(y_positions.max())}")
             
         print("\nNext steps:")
         print("1. Test detection: python spotection_system.py")
@@ -247,7 +247,7 @@ def create_sample_html():
                     <p><strong>${spot.status}</strong></p>
                     ${spot.vehicle ? `<p>Vehicle: ${spot.vehicle.class}</p>` : ''}
                     <p>Confidence: ${(spot.confidence * 100).toFixed(1)}%</p>
-                    <small>Updated: ${new Date(spot.timestamp).toLocaleTimeString()}</small>
+                    <small>Updated: ${new Date(data.timestamp).toLocaleTimeString()}</small>
                 </div>
             `).join('');
         }
@@ -265,6 +265,7 @@ def create_sample_html():
                         total_spots: data.spots.length,
                         free_spots: data.spots.filter(s => s.status === 'FREE').length,
                         occupied_spots: data.spots.filter(s => s.status === 'OCCUPIED').length,
+                        timestamp: data.timestamp,
                         spots: data.spots
                     });
                 }
@@ -2,60 +2,232 @@ import os
 os.environ['KMP_DUPLICATE_LIB_OK'] = 'TRUE'
 
 import cv2
-import json
+from functools import lru_cache
 import numpy as np
-from shapely.geometry import Polygon, box
+import shapely
+import torch
 from ultralytics import YOLO
 
-def quick_fix_detection():
-    """Quick fix with very aggressive detection and visual debugging"""
+from yolox_inference.common import load_image, load_spots, spot_corners
+# Exact overlap falls back to Shapely without numba
+from yolox_inference.jit import NUMBA_AVAILABLE, njit, prange
+
+# Per-detection / per-spot output, e.g. SPOTECTION_DEBUG=1
+DEBUG = os.environ.get("SPOTECTION_DEBUG", "0") not in ("", "0")
+
+# YOLOv8 input size
+INFERENCE_SIZE = 640
+
+# FP16 inference only pays off (and is only supported) on GPU
+USE_HALF = torch.cuda.is_available()
+
+_MODEL = None
+
+def _get_model():
+    """Load YOLO once per process and warm it up on a blank frame"""
+    global _MODEL
+    if _MODEL is None:
+        _MODEL = YOLO("yolov8n.pt")
+        _MODEL.predict(np.zeros((INFERENCE_SIZE, INFERENCE_SIZE, 3), dtype=np.uint8),
+                       imgsz=INFERENCE_SIZE, half=USE_HALF, verbose=False)
+    return _MODEL
+
+@lru_cache(maxsize=4)
+def _load_spot_layout(path, mtime_ns):
+    spots_data = load_spots(path)
+    
+    pts = spot_corners(spots_data)
+    x = pts[:, :, 0].astype(np.float32)
+    y = pts[:, :, 1].astype(np.float32)
+    
+    layout = {
+        "pts": pts,
+        # Per-spot (4, 1, 2) contour views handed straight to OpenCV
+        "contours": [np.ascontiguousarray(p).reshape(-1, 1, 2) for p in pts],
+        "centers": pts.mean(axis=1).astype(np.int32),
+        "aabb": np.concatenate([pts.min(axis=1), pts.max(axis=1)], axis=1).astype(np.float32),
+        # Shoelace formula
+        "areas": 0.5 * np.abs((x * np.roll(y, -1, axis=1) - np.roll(x, -1, axis=1) * y).sum(axis=1)),
+        # Repairs spots with repeated or touching corners, which GEOS can't intersect
+        "polygons": shapely.make_valid(shapely.polygons(pts.astype(np.float64))),
+    }
+    return spots_data, layout
+
+def load_spot_layout(path="data/spot_layout.json"):
+    """Load a spot layout along with its precomputed static geometry.
+    
+    Returns the spot list and a dict of per-spot arrays (corner points,
+    OpenCV contours, label centers, bounding boxes, areas and Shapely
+    polygons). Results are cached until the file changes on disk.
+    """
+    return _load_spot_layout(path, os.stat(path).st_mtime_ns)
+
+def box_overlap_ratios(spot_boxes, det_boxes):
+    """Pairwise overlap of (N, 4) spot boxes with (M, 4) detection boxes.
+    
+    Returns an (N, M) matrix of intersection area divided by the smaller
+    of the two box areas, all boxes given as x1, y1, x2, y2.
+    """
+    ix1 = np.maximum(spot_boxes[:, None, 0], det_boxes[None, :, 0])
+    iy1 = np.maximum(spot_boxes[:, None, 1], det_boxes[None, :, 1])
+    ix2 = np.minimum(spot_boxes[:, None, 2], det_boxes[None, :, 2])
+    iy2 = np.minimum(spot_boxes[:, None, 3], det_boxes[None, :, 3])
+    inter = np.clip(ix2 - ix1, 0, None) * np.clip(iy2 - iy1, 0, None)
+    
+    spot_area = (spot_boxes[:, 2] - spot_boxes[:, 0]) * (spot_boxes[:, 3] - spot_boxes[:, 1])
+    det_area = (det_boxes[:, 2] - det_boxes[:, 0]) * (det_boxes[:, 3] - det_boxes[:, 1])
+    smaller = np.minimum(spot_area[:, None], det_area[None, :])
+    
+    return np.divide(inter, smaller, out=np.zeros_like(inter), where=smaller > 0)
+
+def polygon_overlap_ratios(spot_polygons, det_boxes):
+    """Exact-polygon counterpart of box_overlap_ratios for angled spots.
+    
+    spot_polygons is an (N,) array of Shapely polygons; the whole (N, M)
+    intersection matrix is computed in a single vectorized GEOS call.
+    """
+    det_polygons = shapely.box(det_boxes[:, 0], det_boxes[:, 1], det_boxes[:, 2], det_boxes[:, 3])
+    inter = shapely.area(shapely.intersection(spot_polygons[:, None], det_polygons[None, :]))
+    smaller = np.minimum(shapely.area(spot_polygons)[:, None], shapely.area(det_polygons)[None, :])
+    
+    return np.divide(inter, smaller, out=np.zeros_like(inter), where=smaller > 0)
+
+@njit(cache=True)
+def _clipped_area(poly, x1, y1, x2, y2, buf_a, buf_b):
+    """Area of poly clipped to the box x1, y1, x2, y2 (Sutherland-Hodgman)"""
+    n = poly.shape[0]
+    for k in range(n):
+        buf_a[k, 0] = poly[k, 0]
+        buf_a[k, 1] = poly[k, 1]
+    
+    src, dst = buf_a, buf_b
+    for edge in range(4):
+        # Edges: x >= x1, x <= x2, y >= y1, y <= y2
+        bound = (x1, x2, y1, y2)[edge]
+        axis = edge // 2
+        keep_above = edge % 2 == 0
+        
+        m = 0
+        for k in range(n):
+            cx, cy = src[k, 0], src[k, 1]
+            px, py = src[k - 1 if k > 0 else n - 1, 0], src[k - 1 if k > 0 else n - 1, 1]
+            c_val = cx if axis == 0 else cy
+            p_val = px if axis == 0 else py
+            c_in = c_val >= bound if keep_above else c_val <= bound
+            p_in = p_val >= bound if keep_above else p_val <= bound
+            
+            if c_in != p_in:
+                t = (bound - p_val) / (c_val - p_val)
+                dst[m, 0] = px + t * (cx - px)
+                dst[m, 1] = py + t * (cy - py)
+                m += 1
+            if c_in:
+                dst[m, 0] = cx
+                dst[m, 1] = cy
+                m += 1
+        
+        src, dst = dst, src
+        n = m
+        if n < 3:
+            return 0.0
+    
+    # Shoelace formula
+    area = 0.0
+    for k in range(n):
+        nk = k + 1 if k + 1 < n else 0
+        area += src[k, 0] * src[nk, 1] - src[nk, 0] * src[k, 1]
+    return abs(area) * 0.5
+
+@njit(parallel=True, cache=True)
+def _clipped_overlap_kernel(spot_pts, spot_areas, det_boxes, out):
+    for i in prange(spot_pts.shape[0]):
+        # Each half-plane clip at most doubles the vertex count
+        buf_a = np.empty((spot_pts.shape[1] * 16, 2))
+        buf_b = np.empty((spot_pts.shape[1] * 16, 2))
+        for j in range(det_boxes.shape[0]):
+            x1, y1, x2, y2 = det_boxes[j, 0], det_boxes[j, 1], det_boxes[j, 2], det_boxes[j, 3]
+            smaller = min(spot_areas[i], (x2 - x1) * (y2 - y1))
+            if smaller > 0:
+                out[i, j] = _clipped_area(spot_pts[i], x1, y1, x2, y2, buf_a, buf_b) / smaller
+            else:
+                out[i, j] = 0.0
+
+def clipped_overlap_ratios(spot_pts, spot_areas, det_boxes):
+    """Numba-compiled counterpart of polygon_overlap_ratios.
+    
+    Clips each (K, 2) spot polygon against every detection box directly,
+    without going through Shapely geometry objects.
+    """
+    out = np.zeros((spot_pts.shape[0], det_boxes.shape[0]), dtype=np.float64)
+    _clipped_overlap_kernel(spot_pts.astype(np.float64), spot_areas.astype(np.float64),
+                            det_boxes.astype(np.float64), out)
+    return out
+
+def quick_fix_detection(exact=False, save_path=None):
+    """Quick fix with very aggressive detection and visual debugging
+    
+    Spots are compared to detections by their bounding boxes; pass
+    exact=True to use the true spot polygons instead.
+    
+    Returns the per-spot results and the JPEG-encoded debug image. The
+    image is only written to disk when save_path is given.
+    """
     
     # Load everything
-    model = YOLO("yolov8n.pt")
-    image = cv2.imread("data/test_image.jpg")
+    model = _get_model()
+    image = load_image("data/test_image.jpg")
     
-    with open("data/spot_layout.json", 'r') as f:
-        spots_data = json.load(f)
+    spots_data, layout = load_spot_layout("data/spot_layout.json")
     
     print("=== QUICK FIX DETECTION ===")
     print(f"Image shape: {image.shape}")
     print(f"Spots loaded: {len(spots_data)}")
     
+    # Downscale once to YOLO's native size (keeping aspect ratio) so it does not resize internally
+    scale = min(1.0, INFERENCE_SIZE / max(image.shape[:2]))
+    if scale < 1.0:
+        small = cv2.resize(image, (round(image.shape[1] * scale), round(image.shape[0] * scale)),
+                           interpolation=cv2.INTER_LINEAR)
+    else:
+        small = image
+    
     # Run YOLO with very low confidence threshold
-    results = model("data/test_image.jpg", conf=0.1)[0]  # Lower confidence to catch more
+    results = model.predict(small, conf=0.1, imgsz=INFERENCE_SIZE, half=USE_HALF, verbose=False)[0]  # Lower confidence to catch more
     
-    # Get ALL detections (not just vehicles)
-    all_detections = []
-    vehicle_detections = []
+    # Get ALL detections (not just vehicles), moved off the device once
+    boxes = results.boxes
+    cls_ids = boxes.cls.cpu().numpy().astype(np.int32)
+    confidences = boxes.conf.cpu().numpy()
+    # Back to original image coordinates, where the spot polygons live
+    det_boxes = boxes.xyxy.cpu().numpy().astype(np.float32).reshape(-1, 4) / scale
+    bboxes = det_boxes.astype(np.int32).tolist()
+    class_names = np.array([model.names[c] for c in cls_ids.tolist()], dtype=str)
     
     vehicle_classes = {"car", "truck", "bus", "van", "motorcycle", "bicycle"}
     
-    for i, box_data in enumerate(results.boxes):
-        cls_id = int(box_data.cls[0])
-        class_name = model.names[cls_id]
-        confidence = float(box_data.conf[0])
-        x1, y1, x2, y2 = map(int, box_data.xyxy[0])
-        
-        detection = {
+    # More lenient vehicle detection
+    vehicle_mask = np.isin(class_names, list(vehicle_classes)) & (confidences > 0.1)  # Very low threshold
+    
+    all_detections = [
+        {
             "id": i,
-            "class": class_name,
-            "confidence": confidence,
-            "bbox": (x1, y1, x2, y2),
-            "box": box(x1, y1, x2, y2)
+            "class": str(class_names[i]),
+            "confidence": float(confidences[i]),
+            "bbox": tuple(bboxes[i]),
+            "is_vehicle": bool(vehicle_mask[i])
         }
-        
-        all_detections.append(detection)
-        
-        # More lenient vehicle detection
-        if class_name in vehicle_classes and confidence > 0.1:  # Very low threshold
-            vehicle_detections.append(detection)
+        for i in range(len(cls_ids))
+    ]
     
     print(f"Total detections: {len(all_detections)}")
-    print(f"Vehicle detections: {len(vehicle_detections)}")
+    print(f"Vehicle detections: {int(vehicle_mask.sum())}")
+    
+    # Debug output is collected and printed in one go
+    log_lines = []
     
     # Print all detections for debugging
-    for det in all_detections:
-        print(f"  {det['class']}: {det['confidence']:.2f} at {det['bbox']}")
+    if DEBUG:
+        log_lines.extend(f"  {det['class']}: {det['confidence']:.2f} at {det['bbox']}" for det in all_detections)
     
     # Create debug image showing ALL detections
     debug_image = image.copy()
@@ -64,7 +236,7 @@ def quick_fix_detection():
     for i, det in enumerate(all_detections):
         x1, y1, x2, y2 = det['bbox']
         
-        if det in vehicle_detections:
+        if det["is_vehicle"]:
             color = (255, 0, 0)  # Blue for vehicles we'll use
             thickness = 3
         else:
@@ -78,79 +250,83 @@ def quick_fix_detection():
     # Now analyze spots with VERY aggressive overlap detection
     results_data = []
     
-    for spot in spots_data:
+    # Overlap of every spot against every detection in one pass
+    if exact and NUMBA_AVAILABLE:
+        ratio = clipped_overlap_ratios(layout["pts"], layout["areas"], det_boxes)
+    elif exact:
+        ratio = polygon_overlap_ratios(layout["polygons"], det_boxes)
+    else:
+        # Spots are clicked as rough rectangles, so their bounds are close enough
+        ratio = box_overlap_ratios(layout["aabb"], det_boxes)
+    
+    # VERY aggressive threshold - even tiny overlaps count
+    threshold = 0.01  # 1% overlap!
+    
+    # First try vehicles; if no vehicle overlap, try ANY detection (sometimes YOLO misclassifies)
+    vehicle_ratio = np.where(vehicle_mask[None, :], ratio, 0)
+    has_vehicle = (vehicle_ratio > 0).any(axis=1)
+    candidates = np.where(has_vehicle[:, None], vehicle_ratio, ratio)
+    max_overlaps = candidates.max(axis=1, initial=0)
+    
+    occupied_mask = (candidates > threshold).any(axis=1)
+    statuses = np.where(occupied_mask, "OCCUPIED", "FREE")
+    
+    # The best matching detection is only needed to label occupied spots
+    best = np.full(len(spots_data), -1)
+    if occupied_mask.any():
+        best[occupied_mask] = candidates[occupied_mask].argmax(axis=1)
+    
+    status_colors = {
+        "OCCUPIED": (0, 0, 255),  # Red
+        "FREE": (0, 255, 0)  # Green
+    }
+    
+    for i, spot in enumerate(spots_data):
         spot_id = spot["id"]
-        polygon_coords = spot["polygon"]
+        max_overlap = float(max_overlaps[i])
+        best_detection = all_detections[best[i]] if best[i] >= 0 else None
+        status = str(statuses[i])
         
-        try:
-            spot_polygon = Polygon(polygon_coords)
-            
-            # Check overlap with ALL detections, not just vehicles
-            max_overlap = 0
-            best_detection = None
-            
-            # First try vehicles
-            for det in vehicle_detections:
-                intersection = spot_polygon.intersection(det['box'])
-                if intersection.area > 0:
-                    overlap_ratio = intersection.area / min(spot_polygon.area, det['box'].area)
-                    if overlap_ratio > max_overlap:
-                        max_overlap = overlap_ratio
-                        best_detection = det
-            
-            # If no vehicle overlap, try ANY detection (sometimes YOLO misclassifies)
-            if max_overlap == 0:
-                for det in all_detections:
-                    intersection = spot_polygon.intersection(det['box'])
-                    if intersection.area > 0:
-                        overlap_ratio = intersection.area / min(spot_polygon.area, det['box'].area)
-                        if overlap_ratio > max_overlap:
-                            max_overlap = overlap_ratio
-                            best_detection = det
-            
-            # VERY aggressive threshold - even tiny overlaps count
-            threshold = 0.01  # 1% overlap!
-            
-            if max_overlap > threshold:
-                status = "OCCUPIED"
-                color = (0, 0, 255)  # Red
-            else:
-                status = "FREE" 
-                color = (0, 255, 0)  # Green
-            
-            print(f"{spot_id}: {status} (overlap: {max_overlap:.4f})")
-            if best_detection:
-                print(f"  -> {best_detection['class']} at {best_detection['bbox']}")
-            
-            # Draw spot on debug image
-            pts = np.array(polygon_coords, dtype=np.int32)
-            
-            # Semi-transparent fill
-            overlay = debug_image.copy()
-            cv2.fillPoly(overlay, [pts], (*color, 100))
-            cv2.addWeighted(overlay, 0.3, debug_image, 0.7, 0, debug_image)
-            
-            # Outline
-            cv2.polylines(debug_image, [pts], True, color, 2)
-            
-            # Label
-            label = f"{spot_id}: {status}"
+        if DEBUG:
+            log_lines.append(f"{spot_id}: {status} (overlap: {max_overlap:.4f})")
             if best_detection:
-                label += f" ({best_detection['class'][:3]})"
-            
-            cv2.putText(debug_image, label, tuple(polygon_coords[0]), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
-            
-            results_data.append({
-                "id": spot_id,
-                "status": status,
-                "overlap": max_overlap,
-                "detection": best_detection['class'] if best_detection else None
-            })
-            
-        except Exception as e:
-            print(f"Error with {spot_id}: {e}")
-            continue
+                log_lines.append(f"  -> {best_detection['class']} at {best_detection['bbox']}")
+        
+        results_data.append({
+            "id": spot_id,
+            "status": status,
+            "overlap": max_overlap,
+            "detection": best_detection['class'] if best_detection else None
+        })
+    
+    # Group spot contours by color so each color is one OpenCV call
+    status_groups = [
+        ([layout["contours"][i] for i in np.flatnonzero(statuses == status)], color)
+        for status, color in status_colors.items()
+    ]
+    
+    # Semi-transparent fill of every spot goes into one overlay, blended once
+    overlay = debug_image.copy()
+    for group, color in status_groups:
+        if group:
+            cv2.fillPoly(overlay, group, color)
+    cv2.addWeighted(overlay, 0.3, debug_image, 0.7, 0, debug_image)
+    
+    # Outlines and labels on top of the blended fill
+    for group, color in status_groups:
+        if group:
+            cv2.polylines(debug_image, group, True, color, 2)
+    
+    for i, result in enumerate(results_data):
+        label = f"{result['id']}: {result['status']}"
+        if result["detection"]:
+            label += f" ({result['detection'][:3]})"
+        
+        cv2.putText(debug_image, label, tuple(int(c) for c in layout["pts"][i][0]), 
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
+    
+    if log_lines:
+        print("\n".join(log_lines))
     
     # Summary
     occupied = sum(1 for r in results_data if r["status"] == "OCCUPIED")
@@ -163,9 +339,12 @@ def quick_fix_detection():
     cv2.putText(debug_image, f"Free: {free} | Occupied: {occupied} | Total: {len(results_data)}", 
                (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
     
-    # Save debug image
-    cv2.imwrite("debug_aggressive_detection.jpg", debug_image)
-    print("Saved debug image: debug_aggressive_detection.jpg")
+    # Encode debug image once; only touch the filesystem when asked to
+    jpeg_bytes = cv2.imencode(".jpg", debug_image, [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes()
+    if save_path:
+        with open(save_path, 'wb') as f:
+            f.write(jpeg_bytes)
+        print(f"Saved debug image: {save_path}")
     
     # If still no occupancy detected, there's a fundamental alignment issue
     if occupied == 0:
@@ -181,7 +360,7 @@ def quick_fix_detection():
         for spot in spots_data[:3]:
             print(f"  {spot['id']}: {spot['polygon']}")
     
-    return results_data
+    return results_data, jpeg_bytes
 
 if __name__ == "__main__":
-    quick_fix_detection()
\ No newline at end of file
+    quick_fix_detection(save_path="debug_aggressive_detection.jpg")
\ No newline at end of file
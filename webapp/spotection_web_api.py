@@ -4,54 +4,144 @@ FastAPI backend for the parking detection system
 Provides REST endpoints and WebSocket for live updates
 """
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Request, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import HTMLResponse, FileResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel
-from typing import List, Dict, Optional
-import json
+from contextlib import asynccontextmanager, suppress
+from typing import List, Dict, Optional, Set
+from cachetools import TTLCache
+import hashlib
 import os
+import sys
 import asyncio
 from datetime import datetime, timedelta
+import orjson
 import uvicorn
 
 # Import your detection system
 from spotection_system import SpotectionSystem
+from yolox_inference.common import load_spots, spot_corners, write_json
 
-app = FastAPI(title="Spotection API", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Run the shared inference loop for as long as the server is up"""
+    inference_task = asyncio.create_task(inference_loop())
+    yield
+    inference_task.cancel()
+    with suppress(asyncio.CancelledError):
+        await inference_task
 
-# Enable CORS for web frontend
+app = FastAPI(title="Spotection API", version="1.0.0", lifespan=lifespan)
+
+# Enable CORS for web frontend; a fixed origin list (comma-separated in
+# SPOTECTION_CORS_ORIGINS) lets Starlette skip echoing the request origin
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],  # In production, specify your frontend domain
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_origins=os.environ.get("SPOTECTION_CORS_ORIGINS", "http://localhost:8000").split(","),
+    allow_credentials=False,
+    allow_methods=["GET", "POST"],
+    allow_headers=["Authorization", "Content-Type"],
 )
 
+# Status payloads grow with the spot count and repeat the same keys
+app.add_middleware(GZipMiddleware, minimum_size=500)
+
 # Initialize detection system
 detection_system = SpotectionSystem()
 
+# Messages buffered per client before it is considered too slow and dropped
+SEND_QUEUE_SIZE = 32
+
+def encode_message(message: dict) -> str:
+    """Encode a WebSocket message once with orjson.
+    
+    Sent as a text frame so browsers can JSON.parse it directly.
+    """
+    return orjson.dumps(message, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+
 # WebSocket connection manager
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
+        self.active_connections: Set[WebSocket] = set()
+        # Per-client outgoing queue and the task draining it
+        self.queues: Dict[WebSocket, asyncio.Queue] = {}
+        self.senders: Dict[WebSocket, asyncio.Task] = {}
+        # Pending close() calls for dropped clients; the event loop only
+        # keeps weak references to tasks
+        self.closers: Set[asyncio.Task] = set()
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections.append(websocket)
+        queue = asyncio.Queue(maxsize=SEND_QUEUE_SIZE)
+        self.active_connections.add(websocket)
+        self.queues[websocket] = queue
+        self.senders[websocket] = asyncio.create_task(self._sender(websocket, queue))
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        self._remove([websocket])
+
+    def _remove(self, websockets: List[WebSocket]):
+        gone = [ws for ws in websockets if ws in self.queues]
+        self.active_connections.difference_update(gone)
+        for ws in gone:
+            del self.queues[ws]
+            sender = self.senders.pop(ws)
+            if sender is not asyncio.current_task():
+                sender.cancel()
+
+    def _drop(self, websockets: List[WebSocket]):
+        # Too slow to keep up, disconnect and close them
+        dead = [ws for ws in websockets if ws in self.queues]
+        self._remove(dead)
+        for ws in dead:
+            closer = asyncio.create_task(self._close(ws))
+            self.closers.add(closer)
+            closer.add_done_callback(self.closers.discard)
+
+    async def _sender(self, websocket: WebSocket, queue: asyncio.Queue):
+        # A slow client only ever blocks its own sender
+        try:
+            while True:
+                payload = await queue.get()
+                await websocket.send_text(payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Remove broken connections
+            self.disconnect(websocket)
+
+    def _enqueue(self, websocket: WebSocket, payload: str) -> bool:
+        queue = self.queues.get(websocket)
+        if queue is None:
+            return False
+        try:
+            queue.put_nowait(payload)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def send_personal_message(self, message: dict, websocket: WebSocket) -> bool:
+        """Queue a message for one client; False once it is disconnected"""
+        if self._enqueue(websocket, encode_message(message)):
+            return True
+        self._drop([websocket])
+        return False
 
     async def broadcast(self, message: dict):
-        for connection in self.active_connections:
-            try:
-                await connection.send_json(message)
-            except:
-                # Remove broken connections
-                self.active_connections.remove(connection)
+        # Encode once for all clients; iterate a snapshot and remove the
+        # clients that fell behind in one go afterwards
+        payload = encode_message(message)
+        dead = [ws for ws in list(self.active_connections) if not self._enqueue(ws, payload)]
+        self._drop(dead)
+
+    async def _close(self, websocket: WebSocket):
+        try:
+            await websocket.close(code=1013)  # Try again later
+        except Exception:
+            pass
 
 manager = ConnectionManager()
 
@@ -60,7 +150,6 @@ class SpotStatus(BaseModel):
     id: str
     status: str
     confidence: float
-    timestamp: str
     vehicle: Optional[Dict] = None
 
 class LotStatus(BaseModel):
@@ -79,6 +168,26 @@ class SpotPolygon(BaseModel):
     id: str
     polygon: List[List[int]]
 
+# Declared response models let FastAPI serialize straight to JSON bytes with
+# pydantic's Rust core instead of going through jsonable_encoder
+class ApiStatus(BaseModel):
+    status: str
+    timestamp: str
+    model_loaded: bool
+    active_connections: int
+
+class LotInfo(BaseModel):
+    lot_id: str
+    name: str
+    description: str
+    camera_status: str
+    last_update: str
+
+class LotSpots(BaseModel):
+    lot_id: str
+    spots: List[SpotPolygon]
+    total_spots: int
+
 # API Routes
 @app.get("/")
 async def root():
@@ -94,7 +203,7 @@ async def root():
         }
     }
 
-@app.get("/api/status")
+@app.get("/api/status", response_model=ApiStatus)
 async def get_api_status():
     """Get API health status"""
     return {
@@ -104,7 +213,7 @@ async def get_api_status():
         "active_connections": len(manager.active_connections)
     }
 
-@app.get("/api/lots", response_model=List[Dict])
+@app.get("/api/lots", response_model=List[LotInfo])
 async def get_lots():
     """Get list of available parking lots"""
     # For MVP, return a single lot
@@ -118,7 +227,7 @@ async def get_lots():
         }
     ]
 
-@app.get("/api/lots/{lot_id}/spots")
+@app.get("/api/lots/{lot_id}/spots", response_model=LotSpots)
 async def get_lot_spots(lot_id: str):
     """Get parking spot definitions for a lot"""
     try:
@@ -127,8 +236,7 @@ async def get_lot_spots(lot_id: str):
         if not os.path.exists(spot_layout_path):
             raise HTTPException(status_code=404, detail="Spot layout not found")
         
-        with open(spot_layout_path, 'r') as f:
-            spots = json.load(f)
+        spots = load_spots(spot_layout_path)
         
         return {
             "lot_id": lot_id,
@@ -138,44 +246,84 @@ async def get_lot_spots(lot_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Encoded status payloads and their ETags, reused for STATUS_TTL seconds so
+# polling clients don't trigger a detection run per request
+STATUS_TTL = 2
+_status_cache = TTLCache(maxsize=32, ttl=STATUS_TTL)
+# Detection runs in flight per lot, shared by every request that misses the cache
+_status_pending: Dict[str, asyncio.Task] = {}
+
+async def _compute_lot_status(lot_id: str):
+    """Run detection for a lot, returns the encoded LotStatus and its ETag"""
+    # Load spot layout
+    spot_layout_path = detection_system.config.get("spot_layout_path", "data/spot_layout.json")
+    
+    if not os.path.exists(spot_layout_path):
+        raise HTTPException(status_code=404, detail="Spot layout not found")
+    
+    spots_data = load_spots(spot_layout_path)
+    
+    # Run detection in a worker thread so it doesn't block the event loop
+    image_path = detection_system.config.get("image_path", "data/test_image.jpg")
+    results = await asyncio.to_thread(detection_system.process_frame, image_path, spots_data)
+    
+    # Results come from our own detection pipeline, so build the models
+    # without validation; pydantic's Rust serializer encodes them directly,
+    # skipping jsonable_encoder and response_model validation
+    spot_statuses = [
+        SpotStatus.model_construct(
+            id=result["id"],
+            status=result["status"],
+            confidence=result["confidence"],
+            vehicle=result.get("vehicle")
+        )
+        for result in results
+    ]
+    
+    occupied_count = sum(1 for s in spot_statuses if s.status == "OCCUPIED")
+    
+    lot_status = LotStatus.model_construct(
+        lot_id=lot_id,
+        timestamp=datetime.now().isoformat(),
+        total_spots=len(spot_statuses),
+        free_spots=len(spot_statuses) - occupied_count,
+        occupied_spots=occupied_count,
+        spots=spot_statuses
+    )
+    
+    # Free spots have no vehicle, so leave out the nulls
+    payload = lot_status.model_dump_json(exclude_none=True).encode()
+    
+    # The ETag covers occupancy only, so it stays the same across recomputes
+    # until a spot changes; weak, since the timestamp in the body still moves
+    occupancy = lot_status.model_dump_json(exclude_none=True, exclude={"timestamp"}).encode()
+    return payload, f'W/"{hashlib.md5(occupancy, usedforsecurity=False).hexdigest()}"'
+
+async def _refresh_lot_status(lot_id: str):
+    try:
+        result = _status_cache[lot_id] = await _compute_lot_status(lot_id)
+        return result
+    finally:
+        del _status_pending[lot_id]
+
 @app.get("/api/lots/{lot_id}/status", response_model=LotStatus)
-async def get_lot_status(lot_id: str):
+async def get_lot_status(lot_id: str, request: Request):
     """Get current occupancy status for a parking lot"""
     try:
-        # Load spot layout
-        spot_layout_path = detection_system.config.get("spot_layout_path", "data/spot_layout.json")
-        
-        if not os.path.exists(spot_layout_path):
-            raise HTTPException(status_code=404, detail="Spot layout not found")
-        
-        with open(spot_layout_path, 'r') as f:
-            spots_data = json.load(f)
+        cached = _status_cache.get(lot_id)
+        if cached is None:
+            task = _status_pending.get(lot_id)
+            if task is None:
+                task = _status_pending[lot_id] = asyncio.create_task(_refresh_lot_status(lot_id))
+            # Shielded so one client going away doesn't cancel the run for the rest
+            cached = await asyncio.shield(task)
+        payload, etag = cached
         
-        # Run detection
-        image_path = detection_system.config.get("image_path", "data/test_image.jpg")
-        results = detection_system.process_frame(image_path, spots_data)
-        
-        # Format response
-        spot_statuses = []
-        for result in results:
-            spot_statuses.append(SpotStatus(
-                id=result["id"],
-                status=result["status"],
-                confidence=result["confidence"],
-                timestamp=result["timestamp"],
-                vehicle=result.get("vehicle")
-            ))
+        headers = {"ETag": etag, "Cache-Control": f"public, max-age={STATUS_TTL}"}
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers=headers)
         
-        occupied_count = sum(1 for s in spot_statuses if s.status == "OCCUPIED")
-        
-        return LotStatus(
-            lot_id=lot_id,
-            timestamp=datetime.now().isoformat(),
-            total_spots=len(spot_statuses),
-            free_spots=len(spot_statuses) - occupied_count,
-            occupied_spots=occupied_count,
-            spots=spot_statuses
-        )
+        return Response(content=payload, media_type="application/json", headers=headers)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -183,20 +331,26 @@ async def get_lot_status(lot_id: str):
 @app.post("/api/lots/{lot_id}/calibrate")
 async def calibrate_lot(lot_id: str, spots: List[SpotPolygon]):
     """Update parking spot polygons for a lot (admin only)"""
+    # Convert to format expected by detection system
+    spot_data = []
+    for spot in spots:
+        spot_data.append({
+            "id": spot.id,
+            "polygon": spot.polygon
+        })
+    
+    # The detector only handles 4-corner spots; reject anything else
+    # before it reaches the layout file
+    try:
+        spot_corners(spot_data)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
     try:
         spot_layout_path = detection_system.config.get("spot_layout_path", "data/spot_layout.json")
         
-        # Convert to format expected by detection system
-        spot_data = []
-        for spot in spots:
-            spot_data.append({
-                "id": spot.id,
-                "polygon": spot.polygon
-            })
-        
         # Save to file
-        with open(spot_layout_path, 'w') as f:
-            json.dump(spot_data, f, indent=2)
+        write_json(spot_data, spot_layout_path)
         
         return {
             "message": f"Updated {len(spots)} spots for lot {lot_id}",
@@ -238,10 +392,16 @@ async def get_lot_image(lot_id: str, annotated: bool = True):
             # Find the most recent annotated image
             output_dir = detection_system.config.get("output_dir", "output/")
             if os.path.exists(output_dir):
-                images = [f for f in os.listdir(output_dir) if f.startswith("annotated_") and f.endswith(".jpg")]
-                if images:
-                    latest_image = max(images)
-                    return FileResponse(os.path.join(output_dir, latest_image))
+                latest_image = None
+                latest_mtime = -1
+                with os.scandir(output_dir) as entries:
+                    for entry in entries:
+                        if entry.name.startswith("annotated_") and entry.name.endswith(".jpg"):
+                            mtime = entry.stat().st_mtime
+                            if mtime > latest_mtime:
+                                latest_mtime, latest_image = mtime, entry.path
+                if latest_image:
+                    return FileResponse(latest_image)
         
         # Return raw image
         image_path = detection_system.config.get("image_path", "data/test_image.jpg")
@@ -253,40 +413,60 @@ async def get_lot_image(lot_id: str, annotated: bool = True):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Latest status update, sent to clients as soon as they connect
+latest_update: Optional[Dict] = None
+
+async def inference_loop():
+    """Run detection once per tick and push the result to every WebSocket client"""
+    global latest_update
+    while True:
+        # Send periodic updates (every 30 seconds in production)
+        await asyncio.sleep(5)  # 5 seconds for demo
+        
+        if not manager.active_connections:
+            continue
+        
+        try:
+            # Get current status
+            spot_layout_path = detection_system.config.get("spot_layout_path", "data/spot_layout.json")
+            if os.path.exists(spot_layout_path):
+                spots_data = load_spots(spot_layout_path)
+                
+                image_path = detection_system.config.get("image_path", "data/test_image.jpg")
+                results = await asyncio.to_thread(detection_system.process_frame, image_path, spots_data)
+                
+                # One timestamp for the whole lot rather than one per spot
+                latest_update = {
+                    "type": "status_update",
+                    "lot_id": "main_lot",
+                    "timestamp": datetime.now().isoformat(),
+                    "spots": [
+                        {key: value for key, value in result.items() if key != "timestamp"}
+                        for result in results
+                    ]
+                }
+                
+                await manager.broadcast(latest_update)
+                
+        except Exception as e:
+            print(f"Error in WebSocket update: {e}")
+
 # WebSocket endpoint for live updates
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     """WebSocket for real-time parking updates"""
     await manager.connect(websocket)
+    if latest_update is not None:
+        manager.send_personal_message(latest_update, websocket)
     try:
+        # Updates are pushed by the shared inference loop; just wait for
+        # the client to go away
         while True:
-            # Send periodic updates (every 30 seconds in production)
-            await asyncio.sleep(5)  # 5 seconds for demo
-            
-            try:
-                # Get current status
-                spot_layout_path = detection_system.config.get("spot_layout_path", "data/spot_layout.json")
-                if os.path.exists(spot_layout_path):
-                    with open(spot_layout_path, 'r') as f:
-                        spots_data = json.load(f)
-                    
-                    image_path = detection_system.config.get("image_path", "data/test_image.jpg")
-                    results = detection_system.process_frame(image_path, spots_data)
-                    
-                    update_message = {
-                        "type": "status_update",
-                        "lot_id": "main_lot",
-                        "timestamp": datetime.now().isoformat(),
-                        "spots": results
-                    }
-                    
-                    await websocket.send_json(update_message)
-                    
-            except Exception as e:
-                print(f"Error in WebSocket update: {e}")
-                break
+            await websocket.receive_text()
                 
     except WebSocketDisconnect:
+        pass
+    finally:
         manager.disconnect(websocket)
 
 # Serve static files (for frontend)
@@ -407,4 +587,18 @@ if __name__ == "__main__":
     print("Admin interface available at: http://localhost:8000/admin")
     print("API documentation at: http://localhost:8000/docs")
     
-    uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    # C-accelerated event loop and HTTP parser (uvicorn[standard]); uvloop
+    # has no Windows build. Connections and broadcasts live in-process, so
+    # extra workers each serve their own set of WebSocket clients.
+    workers = int(os.environ.get("SPOTECTION_WORKERS", "1"))
+    uvicorn.run(
+        # Worker processes need an import string; a single worker reuses this
+        # already-imported app instead of loading the module a second time
+        app if workers == 1 else "spotection_web_api:app",
+        host="0.0.0.0",
+        port=8000,
+        reload=False,
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools",
+        workers=workers
+    )
\ No newline at end of file
@@ -0,0 +1,87 @@
+"""
+Shared helpers for the detection scripts
+Kept free of torch / ultralytics so any module can import it cheaply
+"""
+
+import json
+import os
+from functools import lru_cache
+import cv2
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def read_json(path):
+    if orjson is not None:
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def write_json(data, path):
+    if orjson is not None:
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+    else:
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=2)
+
+@lru_cache(maxsize=8)
+def _load_spots(path, mtime_ns):
+    return read_json(path)
+
+def load_spots(path):
+    """Parse a spot layout file, reusing the last parse until the file changes on disk.
+
+    The returned list is shared between callers; don't modify it.
+    """
+    return _load_spots(path, os.stat(path).st_mtime_ns)
+
+def _segments_cross(a, b, c, d):
+    """Whether segments a-b and c-d properly cross, for (N, 2) arrays of endpoints"""
+    def orientation(p, q, r):
+        return np.sign((q[:, 0] - p[:, 0]) * (r[:, 1] - p[:, 1]) - (q[:, 1] - p[:, 1]) * (r[:, 0] - p[:, 0]))
+    return ((orientation(a, b, c) * orientation(a, b, d) < 0)
+            & (orientation(c, d, a) * orientation(c, d, b) < 0))
+
+def spot_corners(spots):
+    """Stack the spots' polygons into an (N, 4, 2) int32 array.
+
+    Spots are simple 4-corner polygons as produced by the calibration tool;
+    a ValueError names the first spot that isn't one.
+    """
+    for i, spot in enumerate(spots):
+        polygon = spot.get("polygon") or []
+        if len(polygon) != 4 or any(len(point) != 2 for point in polygon):
+            raise ValueError(f"Spot {spot.get('id', i)} must have 4 [x, y] corners, got {polygon}")
+    pts = np.array([spot["polygon"] for spot in spots], dtype=np.int32).reshape(-1, 4, 2)
+
+    # Corners clicked out of order make a self-intersecting "bowtie"; in a
+    # simple quad opposite edges never cross
+    corners = pts.astype(np.int64)
+    p0, p1, p2, p3 = corners[:, 0], corners[:, 1], corners[:, 2], corners[:, 3]
+    crossed = _segments_cross(p0, p1, p2, p3) | _segments_cross(p1, p2, p3, p0)
+    if crossed.any():
+        i = int(crossed.argmax())
+        raise ValueError(f"Spot {spots[i].get('id', i)} crosses itself, its corners must go around "
+                         f"the spot in order, got {spots[i]['polygon']}")
+    return pts
+
+@lru_cache(maxsize=4)
+def _decode(path, mtime_ns):
+    image = cv2.imread(path)
+    if image is None:
+        raise FileNotFoundError(f"Could not decode image {path}")
+    # The same array is returned to every caller
+    image.setflags(write=False)
+    return image
+
+def load_image(path):
+    """Decode an image, reusing the last decode until the file changes on disk.
+
+    The returned array is read-only; copy it before drawing on it.
+    """
+    return _decode(path, os.stat(path).st_mtime_ns)
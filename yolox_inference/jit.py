@@ -0,0 +1,15 @@
+"""
+Optional Numba JIT
+Without numba, njit leaves functions as plain Python and prange is range;
+callers check NUMBA_AVAILABLE to pick a vectorized fallback instead
+"""
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        return lambda func: func
@@ -0,0 +1,146 @@
+"""
+ONNX Runtime YOLOv8 detector
+Runs an exported yolov8n.onnx directly, without the ultralytics Python wrapper
+"""
+
+import ast
+import os
+import threading
+import cv2
+import numpy as np
+import onnxruntime as ort
+
+ONNX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "weights", "yolov8n.onnx")
+
+# Preferred execution providers, fastest first
+PROVIDERS = ["TensorrtExecutionProvider", "CUDAExecutionProvider", "CPUExecutionProvider"]
+
+# Per-class NMS offset, as in ultralytics; raw boxes aren't clipped to the
+# input size, so it has to be well beyond any box coordinate
+MAX_WH = 7680
+
+def export_onnx(weights="yolov8n.pt", output_path=ONNX_PATH, imgsz=640):
+    """One-time export of the PyTorch weights to ONNX (FP16 when a GPU is available)"""
+    import torch
+    from ultralytics import YOLO
+
+    use_gpu = torch.cuda.is_available()
+    exported = YOLO(weights).export(format="onnx", imgsz=imgsz, dynamic=False,
+                                    half=use_gpu, device=0 if use_gpu else "cpu")
+    os.replace(exported, output_path)
+    return output_path
+
+def nms(boxes, scores, iou_threshold):
+    """Greedy non-maximum suppression, returns indices of kept boxes by score"""
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    order = scores.argsort()[::-1]
+
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+
+        iw = np.clip(np.minimum(boxes[i, 2], boxes[rest, 2]) - np.maximum(boxes[i, 0], boxes[rest, 0]), 0, None)
+        ih = np.clip(np.minimum(boxes[i, 3], boxes[rest, 3]) - np.maximum(boxes[i, 1], boxes[rest, 1]), 0, None)
+        inter = iw * ih
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-9)
+
+        order = rest[iou <= iou_threshold]
+
+    return np.array(keep, dtype=np.int64)
+
+class YOLOv8ONNX:
+    """YOLOv8 detector backed by a single ONNX Runtime session.
+
+    Calling it on a BGR image returns (boxes, confidences, class_ids), with
+    boxes as an (N, 4) float32 array of x1, y1, x2, y2 in image coordinates.
+    """
+
+    def __init__(self, path=ONNX_PATH, providers=None):
+        if not os.path.exists(path):
+            export_onnx(output_path=path)
+
+        available = ort.get_available_providers()
+        self.session = ort.InferenceSession(
+            path, providers=providers or [p for p in PROVIDERS if p in available]
+        )
+
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.output_name = self.session.get_outputs()[0].name
+        self.imgsz = model_input.shape[2]
+        self.dtype = np.float16 if model_input.type == "tensor(float16)" else np.float32
+
+        # Class names are stored in the exported model's metadata
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.names = ast.literal_eval(metadata["names"]) if "names" in metadata else {}
+
+        # Letterbox canvas and input tensor, reused for every frame; the lock
+        # keeps concurrent callers from overwriting each other's input
+        self.canvas = np.empty((self.imgsz, self.imgsz, 3), dtype=np.uint8)
+        self.input_tensor = np.empty((1, 3, self.imgsz, self.imgsz), dtype=self.dtype)
+        self.lock = threading.Lock()
+
+    def preprocess(self, image):
+        """Letterbox image into the input tensor, returns (scale, left, top)"""
+        h, w = image.shape[:2]
+        scale = min(self.imgsz / h, self.imgsz / w)
+        nh, nw = round(h * scale), round(w * scale)
+        top, left = (self.imgsz - nh) // 2, (self.imgsz - nw) // 2
+
+        self.canvas[:] = 114
+        self.canvas[top:top + nh, left:left + nw] = cv2.resize(image, (nw, nh), interpolation=cv2.INTER_LINEAR)
+
+        # BGR HWC uint8 -> RGB CHW in [0, 1]
+        np.multiply(self.canvas[:, :, ::-1].transpose(2, 0, 1), 1 / 255,
+                    out=self.input_tensor[0], casting="unsafe")
+        return scale, left, top
+
+    def __call__(self, image, conf=0.25, iou=0.7, max_det=300):
+        # Same NMS IoU default as ultralytics, so adjacent parked cars aren't merged
+        with self.lock:
+            scale, left, top = self.preprocess(image)
+            output = self.session.run([self.output_name], {self.input_name: self.input_tensor})[0]
+
+        # (1, 4 + num_classes, num_anchors) -> (num_anchors, 4 + num_classes)
+        pred = output[0].T.astype(np.float32)
+        class_scores = pred[:, 4:]
+        class_ids = class_scores.argmax(axis=1)
+        confidences = class_scores[np.arange(len(pred)), class_ids]
+
+        mask = confidences > conf
+        pred, class_ids, confidences = pred[mask], class_ids[mask], confidences[mask]
+
+        # cx, cy, w, h -> x1, y1, x2, y2
+        boxes = np.empty((len(pred), 4), dtype=np.float32)
+        boxes[:, :2] = pred[:, :2] - pred[:, 2:4] / 2
+        boxes[:, 2:] = pred[:, :2] + pred[:, 2:4] / 2
+
+        # Per-class NMS by shifting each class into its own coordinate range
+        offsets = class_ids[:, None].astype(np.float32) * MAX_WH
+        keep = nms(boxes + offsets, confidences, iou)[:max_det]
+        boxes, confidences, class_ids = boxes[keep], confidences[keep], class_ids[keep]
+
+        # Undo the letterbox
+        boxes[:, [0, 2]] -= left
+        boxes[:, [1, 3]] -= top
+        boxes /= scale
+        h, w = image.shape[:2]
+        boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, w)
+        boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, h)
+
+        return boxes, confidences, class_ids
+
+_DETECTOR = None
+_DETECTOR_LOCK = threading.Lock()
+
+def get_detector():
+    """Return the process-wide detector, creating its session on first use"""
+    global _DETECTOR
+    if _DETECTOR is None:
+        with _DETECTOR_LOCK:
+            # Only one thread loads (and if needed exports) the model
+            if _DETECTOR is None:
+                _DETECTOR = YOLOv8ONNX()
+    return _DETECTOR
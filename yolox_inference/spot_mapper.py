@@ -1,68 +1,193 @@
-import json
+import logging
+import os
+from functools import lru_cache
 import cv2
 import numpy as np
 from shapely.geometry import Polygon, box
-from ultralytics import YOLO
-
-# Load parking spot layout
-with open("data/spot_layout.json", "r") as f:
-    spots = json.load(f)
-
-# Load test image
-image_path = "data/test_image.jpg"
-image = cv2.imread(image_path)
-
-# Run YOLOv8
-model = YOLO("yolov8n.pt")
-results = model(image_path)[0]
-
-# Prepare output
-output = image.copy()
-
-# Convert detection boxes to shapely boxes
-detections = []
-for box_data in results.boxes:
-    x1, y1, x2, y2 = box_data.xyxy[0]
-    conf = float(box_data.conf[0])
-    cls = int(box_data.cls[0])
-    label = model.names[cls]
-    if label in ["car", "truck", "van"]:
-        x1, y1, x2, y2 = map(int, (x1, y1, x2, y2))
-        detections.append({
-            "box": (x1, y1, x2, y2),
-            "conf": conf,
-            "label": label
-        })
-        # Draw detection box on image (blue)
-        cv2.rectangle(output, (x1, y1), (x2, y2), (255, 0, 0), 2)
-        cv2.putText(output, label, (x1, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 1)
 
-# Analyze each spot
-for spot in spots:
-    spot_id = spot["id"]
-    poly_points = np.array(spot["polygon"], dtype=np.int32)
-    spot_poly = Polygon(poly_points)
+try:
+    from .common import load_image, load_spots
+    from .jit import NUMBA_AVAILABLE, njit, prange
+    from .onnx_detector import get_detector
+except ImportError:  # run as a script from the repo root
+    from common import load_image, load_spots
+    from jit import NUMBA_AVAILABLE, njit, prange
+    from onnx_detector import get_detector
+
+logger = logging.getLogger(__name__)
+
+VEHICLE_LABELS = ("car", "truck", "van")
+OVERLAP_THRESHOLD = 0.15
+
+@njit(parallel=True, cache=True, fastmath=True)
+def _box_match_kernel(spots, dets, spot_areas, det_areas, thr, match, overlap):
+    for i in prange(spots.shape[0]):
+        for j in range(dets.shape[0]):
+            iw = max(0.0, min(spots[i, 2], dets[j, 2]) - max(spots[i, 0], dets[j, 0]))
+            ih = max(0.0, min(spots[i, 3], dets[j, 3]) - max(spots[i, 1], dets[j, 1]))
+            inter = iw * ih
+            # Check overlap from both perspectives
+            if inter > thr * spot_areas[i] or inter > thr * det_areas[j]:
+                match[i] = j
+                overlap[i] = inter
+                break
+
+def box_matches(spots_xyxy, dets_xyxy, spot_areas, det_areas, thr=OVERLAP_THRESHOLD):
+    """First detection box overlapping each spot box by more than thr.
+    
+    Returns the matching detection index per spot (-1 if none) and the
+    intersection area of that match.
+    """
+    match = np.full(len(spots_xyxy), -1, dtype=np.int64)
+    overlap = np.zeros(len(spots_xyxy), dtype=np.float64)
+
+    if NUMBA_AVAILABLE:
+        _box_match_kernel(spots_xyxy, dets_xyxy, spot_areas, det_areas, thr, match, overlap)
+        return match, overlap
+
+    iw = np.clip(np.minimum(spots_xyxy[:, None, 2], dets_xyxy[None, :, 2])
+                 - np.maximum(spots_xyxy[:, None, 0], dets_xyxy[None, :, 0]), 0, None)
+    ih = np.clip(np.minimum(spots_xyxy[:, None, 3], dets_xyxy[None, :, 3])
+                 - np.maximum(spots_xyxy[:, None, 1], dets_xyxy[None, :, 1]), 0, None)
+    inter = iw * ih
+
+    occupied = (inter > thr * spot_areas[:, None]) | (inter > thr * det_areas[None, :])
+    hit = occupied.any(axis=1)
+    if hit.any():
+        match[hit] = occupied[hit].argmax(axis=1)
+        overlap[hit] = inter[hit, match[hit]]
+    return match, overlap
+
+def warmup():
+    """Compile (or load from numba's cache) the overlap kernel ahead of the first frame"""
+    if NUMBA_AVAILABLE:
+        boxes = np.zeros((1, 4), dtype=np.float32)
+        box_matches(boxes, boxes, np.ones(1), np.ones(1, dtype=np.float32))
+
+def detect(image, model=None):
+    """Run YOLOv8 on a BGR image and return vehicle detections as dicts"""
+    model = model or get_detector()
+    det_boxes, det_confs, det_classes = model(image)
+
+    # Convert detection boxes to shapely boxes
+    detections = []
+    for (x1, y1, x2, y2), conf, cls in zip(det_boxes, det_confs, det_classes):
+        conf = float(conf)
+        label = model.names[int(cls)]
+        if label in VEHICLE_LABELS:
+            x1, y1, x2, y2 = map(int, (x1, y1, x2, y2))
+            detections.append({
+                "box": (x1, y1, x2, y2),
+                "shape": box(x1, y1, x2, y2),
+                "conf": conf,
+                "label": label
+            })
+    return detections
+
+def build_layout(spots):
+    """Static geometry of a spot layout, computed once rather than per frame"""
+    points = [np.array(spot["polygon"], dtype=np.int32) for spot in spots]
+    polygons = [Polygon(poly_points) for poly_points in points]
+    return {
+        "ids": [spot["id"] for spot in spots],
+        "points": points,
+        "polygons": polygons,
+        "areas": np.array([poly.area for poly in polygons], dtype=np.float64),
+        "bounds": np.array([poly.bounds for poly in polygons], dtype=np.float32).reshape(-1, 4),
+        # Axis-aligned rectangles can use plain box math instead of shapely
+        "is_rect": [abs(poly.area - poly.envelope.area) < 1e-6 for poly in polygons],
+    }
+
+@lru_cache(maxsize=4)
+def _load_layout(path, mtime_ns):
+    return build_layout(load_spots(path))
+
+def load_layout(path="data/spot_layout.json"):
+    """Spot layout geometry for the JSON file at path, cached until it changes on disk"""
+    return _load_layout(path, os.stat(path).st_mtime_ns)
+
+def map_spots(layout, detections):
+    """Mark each parking spot of a layout occupied or free given vehicle detections"""
+    debug = logger.isEnabledFor(logging.DEBUG)
+
+    # Box overlap of every spot against every detection in one pass
+    spot_areas = layout["areas"]
+    dets_xyxy = np.array([det["box"] for det in detections], dtype=np.float32).reshape(-1, 4)
+    det_areas = (dets_xyxy[:, 2] - dets_xyxy[:, 0]) * (dets_xyxy[:, 3] - dets_xyxy[:, 1])
+    match, overlap = box_matches(layout["bounds"], dets_xyxy, spot_areas, det_areas)
 
-    occupied = False
+    # Analyze each spot
+    results = []
+    spot_geometry = zip(layout["ids"], layout["polygons"], spot_areas, layout["points"], layout["is_rect"])
+    for i, (spot_id, spot_poly, spot_area, poly_points, is_rect) in enumerate(spot_geometry):
+        occupied = False
+        if is_rect:
+            if match[i] >= 0:
+                occupied = True
+                if debug:
+                    logger.debug("%s OCCUPIED by %s — overlap=%.2f", spot_id, detections[match[i]]['label'], overlap[i])
+        else:
+            sb = layout["bounds"][i]
+            for det in detections:
+                # Cheap bounding box rejection before any shapely work
+                x1, y1, x2, y2 = det["box"]
+                if x2 < sb[0] or x1 > sb[2] or y2 < sb[1] or y1 > sb[3]:
+                    continue
+
+                car_box = det["shape"]
+                overlap_area = spot_poly.intersection(car_box).area
+
+                # Check overlap from both perspectives
+                if (overlap_area / spot_area > OVERLAP_THRESHOLD) or (overlap_area / car_box.area > OVERLAP_THRESHOLD):
+                    occupied = True
+                    if debug:
+                        logger.debug("%s OCCUPIED by %s — overlap=%.2f", spot_id, det['label'], overlap_area)
+                    break
+
+        results.append({"id": spot_id, "polygon": poly_points, "occupied": occupied})
+    return results
+
+def draw(image, detections, spot_results):
+    """Return a copy of image with detections and spot states drawn on it"""
+    output = image.copy()
+
+    # Draw detection boxes (blue)
     for det in detections:
         x1, y1, x2, y2 = det["box"]
-        car_box = box(x1, y1, x2, y2)
-        overlap_area = spot_poly.intersection(car_box).area
-
-        # Check overlap from both perspectives
-        if (overlap_area / spot_poly.area > 0.15) or (overlap_area / car_box.area > 0.15):
-            occupied = True
-            print(f"[DEBUG] {spot_id} OCCUPIED by {det['label']} — Overlap area: {overlap_area:.2f}")
-            break
-        else:
-            print(f"[DEBUG] {spot_id} NOT OCCUPIED — Overlap: {overlap_area:.2f}")
+        cv2.rectangle(output, (x1, y1), (x2, y2), (255, 0, 0), 2)
+        cv2.putText(output, det["label"], (x1, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 1)
+
+    # Draw the spot polygons
+    for spot in spot_results:
+        occupied = spot["occupied"]
+        poly_points = spot["polygon"]
+        color = (0, 0, 255) if occupied else (0, 255, 0)
+        cv2.polylines(output, [poly_points], isClosed=True, color=color, thickness=2)
+        label_text = f"{spot['id']}: {'OCCUPIED' if occupied else 'FREE'}"
+        cv2.putText(output, label_text, tuple(poly_points[0]), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
+
+    return output
+
+def run(image_path: str, layout) -> list[dict]:
+    """Detect vehicles in image_path and return the occupancy of each spot.
+
+    layout comes from load_layout() or build_layout().
+    """
+    return map_spots(layout, detect(load_image(image_path)))
+
+if __name__ == "__main__":
+    # Load parking spot layout
+    layout = load_layout("data/spot_layout.json")
+
+    # Load test image
+    image = cv2.imread("data/test_image.jpg")
+
+    # Compile the overlap kernel up front rather than on the first frame
+    warmup()
 
-    # Draw the spot polygon
-    color = (0, 0, 255) if occupied else (0, 255, 0)
-    cv2.polylines(output, [poly_points], isClosed=True, color=color, thickness=2)
-    label_text = f"{spot_id}: {'OCCUPIED' if occupied else 'FREE'}"
-    cv2.putText(output, label_text, tuple(poly_points[0]), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
+    detections = detect(image)
+    spot_results = map_spots(layout, detections)
 
-# Save visualization
-cv2.imwrite("output_spots.jpg", output)
-print("[INFO] Annotated image saved as 'output_spots.jpg'")
+    # Save visualization
+    cv2.imwrite("output_spots.jpg", draw(image, detections, spot_results))
+    print("[INFO] Annotated image saved as 'output_spots.jpg'")
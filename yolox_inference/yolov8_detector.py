@@ -1,19 +1,38 @@
-from ultralytics import YOLO
 import cv2
 
-# Load YOLOv8 pre-trained model (YOLOv8n = nano / v8s = small)
-model = YOLO("yolov8n.pt")  # You can also try 'yolov8s.pt' for better accuracy
+try:
+    from .onnx_detector import get_detector
+except ImportError:  # run as a script from the repo root
+    from onnx_detector import get_detector
 
-# Inference on image
-image_path = "data/test_image.jpg"
-results = model(image_path)
+def detect(image, model=None):
+    """Run YOLOv8 (via the shared ONNX Runtime session) on a BGR image"""
+    model = model or get_detector()
+    boxes, confs, classes = model(image)
+    return [
+        {"box": tuple(map(int, xyxy)), "conf": float(conf), "label": model.names[int(cls)]}
+        for xyxy, conf, cls in zip(boxes, confs, classes)
+    ]
 
-# Plot and save results
-res_plotted = results[0].plot()
-cv2.imwrite("output.jpg", res_plotted)
+def plot(image, detections):
+    """Return a copy of image with detection boxes and labels drawn on it"""
+    res_plotted = image.copy()
+    for det in detections:
+        x1, y1, x2, y2 = det["box"]
+        cv2.rectangle(res_plotted, (x1, y1), (x2, y2), (255, 0, 0), 2)
+        cv2.putText(res_plotted, f"{det['label']} {det['conf']:.2f}", (x1, y1 - 5),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 1)
+    return res_plotted
 
-# Print detections
-for box in results[0].boxes:
-    cls = int(box.cls[0])
-    conf = float(box.conf[0])
-    print(f"[{model.names[cls]}] Confidence: {conf:.2f}")
+if __name__ == "__main__":
+    # Inference on image
+    image_path = "data/test_image.jpg"
+    image = cv2.imread(image_path)
+    detections = detect(image)
+
+    # Plot and save results
+    cv2.imwrite("output.jpg", plot(image, detections))
+
+    # Print detections
+    for det in detections:
+        print(f"[{det['label']}] Confidence: {det['conf']:.2f}")